@@ -4,13 +4,33 @@
 
 import os
 import json
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import pydeck as pdk
 
+# orjson 解析較快；沒安裝就退回標準庫 json
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_loads(b: bytes) -> Any:
+        return json.loads(b.decode("utf-8"))
+
+# pyarrow（streamlit 本身就會裝）：讀寫 Parquet 快照用
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 # -----------------------------
 # 基本設定
 # -----------------------------
@@ -27,6 +47,35 @@ DATA_JSON_PATH = os.path.join("data", "taichung_micro_latest.json")
 # -----------------------------
 # PM2.5 分級（依你畫面門檻）
 # -----------------------------
+PM25_BINS = [-np.inf, 15.4, 35.4, 54.4, np.inf]
+PM25_LEVELS = ["良好", "普通", "敏感族群留意", "不健康"]
+
+LEVEL_TO_ADVICE = {
+    "良好": "可正常活動。",
+    "普通": "多數人可正常活動；敏感族群留意身體狀況。",
+    "敏感族群留意": "敏感族群建議減少戶外劇烈活動。",
+    "不健康": "建議減少戶外活動；敏感族群避免外出。",
+}
+
+LEVEL_TO_TAG = {"良好": "🟢", "普通": "🟡", "敏感族群留意": "🟠", "不健康": "🔴"}
+
+LEVEL_TO_COLOR = {
+    "良好": [0, 200, 120, 180],
+    "普通": [240, 200, 0, 180],
+    "敏感族群留意": [255, 140, 0, 180],
+    "不健康": [230, 60, 60, 180],
+}
+DEFAULT_COLOR = [120, 120, 120, 160]
+
+# 依 PM25_LEVELS 順序排的 RGBA 查表；最後一列是未知分級（Categorical code = -1 剛好取到它）
+LEVEL_RGBA = np.array([LEVEL_TO_COLOR[lv] for lv in PM25_LEVELS] + [DEFAULT_COLOR], dtype=np.uint8)
+RGBA_COLS = ["color_r", "color_g", "color_b", "color_a"]
+LEVEL_DTYPE = pd.CategoricalDtype(categories=PM25_LEVELS, ordered=True)
+
+# 點位半徑（公尺）：隨 PM2.5 縮放，或固定大小
+RADIUS_FIXED = 60
+
+
 def pm25_level(pm25: float) -> Tuple[str, str]:
     """
     門檻（與你畫面一致）：
@@ -34,36 +83,40 @@ def pm25_level(pm25: float) -> Tuple[str, str]:
     15.5–35.4 普通
     35.5–54.4 敏感族群留意
     >=54.5 不健康
+
+    單一數值用（KPI / Top3）；整欄分級請用 normalize_df 內的 pd.cut。
     """
     if pm25 <= 15.4:
-        return "良好", "可正常活動。"
-    if pm25 <= 35.4:
-        return "普通", "多數人可正常活動；敏感族群留意身體狀況。"
-    if pm25 <= 54.4:
-        return "敏感族群留意", "敏感族群建議減少戶外劇烈活動。"
-    return "不健康", "建議減少戶外活動；敏感族群避免外出。"
+        level = "良好"
+    elif pm25 <= 35.4:
+        level = "普通"
+    elif pm25 <= 54.4:
+        level = "敏感族群留意"
+    else:
+        level = "不健康"
+    return level, LEVEL_TO_ADVICE[level]
 
 
 def pm25_tag(level: str) -> str:
-    return {"良好": "🟢", "普通": "🟡", "敏感族群留意": "🟠", "不健康": "🔴"}.get(level, "⚪")
-
-
-COLOR_MAP = {
-    "良好": [0, 200, 120, 180],
-    "普通": [240, 200, 0, 180],
-    "敏感族群留意": [255, 140, 0, 180],
-    "不健康": [230, 60, 60, 180],
-}
-def color_of(level: str) -> List[int]:
-    return COLOR_MAP.get(level, [120, 120, 120, 160])
+    return LEVEL_TO_TAG.get(level, "⚪")
 
 
 # -----------------------------
 # JSON 讀取與正規化
 # -----------------------------
 def load_json_snapshot(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return _json_loads(f.read())
+
+
+# records 可能所在的位置（依優先順序）：直接 records / data，再來是 result/response/data 裡的 records
+RECORDS_PATHS = (
+    ("records",),
+    ("data",),
+    ("result", "records"),
+    ("response", "records"),
+    ("data", "records"),
+)
 
 
 def extract_records(obj: Any) -> List[Dict[str, Any]]:
@@ -83,33 +136,33 @@ def extract_records(obj: Any) -> List[Dict[str, Any]]:
     if isinstance(obj, list):
         return obj
 
-    if not isinstance(obj, dict):
-        return []
+    # 依序走候選路徑，第一個是 list 的就回傳
+    for path in RECORDS_PATHS:
+        cur = obj
+        for k in path:
+            cur = cur.get(k) if isinstance(cur, dict) else None
+        if isinstance(cur, list):
+            return cur
 
-    # 直接 records / data
-    if isinstance(obj.get("records"), list):
-        return obj["records"]
-    if isinstance(obj.get("data"), list):
-        return obj["data"]
+    return []
 
-    # 常見巢狀：result/response/data 裡的 records
-    for k in ["result", "response", "data"]:
-        v = obj.get(k)
-        if isinstance(v, dict) and isinstance(v.get("records"), list):
-            return v["records"]
 
-    return []
+def records_to_frame(records: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    list-of-dicts → DataFrame。
+    建表時就只取 USED_COLS 認得的欄位（Id、Device 等用不到的欄位不會變成 pandas 欄，也不必事後再複製一份）。
+    """
+    # 先收集所有列出現過的欄名（維持第一次出現的順序），再挑出用得到的
+    all_cols = dict.fromkeys(k for r in records if isinstance(r, dict) for k in r)
+    return pd.DataFrame(records, columns=[c for c in all_cols if is_used_col(c)])
 
 
-def normalize_df(records: List[Dict[str, Any]]) -> pd.DataFrame:
-    df = pd.DataFrame(records).copy()
-    if df.empty:
-        return df
+def is_used_col(col: Any) -> bool:
+    return str(col).strip().lower() in USED_COLS
 
-    df.columns = [str(c).strip().lower() for c in df.columns]
-    
-       
-    rename_map = {
+
+# 原始欄名（已轉小寫）→ 標準欄名；同一標準欄名有多個別名時，排前面的優先
+RENAME_MAP = {
     "longitude": "lon",
     "lng": "lon",
     "long": "lon",
@@ -132,11 +185,27 @@ def normalize_df(records: List[Dict[str, Any]]) -> pd.DataFrame:
 
     "town": "district",
     "landmark": "name",
-    }
+}
+
+# normalize_df 會用到的原始欄位（別名、標準欄名、time）；其餘欄位建 DataFrame 時就略過
+USED_COLS = set(RENAME_MAP) | set(RENAME_MAP.values()) | {"name", "district", "time"}
+
 
-    for k, v in rename_map.items():
-        if k in df.columns and v not in df.columns:
-            df = df.rename(columns={k: v})
+def normalize_df(records: List[Dict[str, Any]]) -> pd.DataFrame:
+    df = records_to_frame(records)
+    if df.empty:
+        return df
+
+    df.columns = [str(c).strip().lower() for c in df.columns]
+
+    # 先算出這次實際要改的欄名，再一次 rename（不要每個候選都產生一個新 DataFrame）
+    existing = set(df.columns)
+    effective: Dict[str, str] = {}
+    for k, v in RENAME_MAP.items():
+        if k in existing and v not in existing:
+            effective[k] = v
+            existing.add(v)  # 同一個標準欄名只取第一個命中的別名
+    df = df.rename(columns=effective)
 
     # 轉數字欄位
     for c in ["lon", "lat", "pm25", "temp", "humidity"]:
@@ -147,20 +216,56 @@ def normalize_df(records: List[Dict[str, Any]]) -> pd.DataFrame:
     if "lon" not in df.columns or "lat" not in df.columns or "pm25" not in df.columns:
         return pd.DataFrame()
 
-    df = df.dropna(subset=["lon", "lat", "pm25"]).copy()
-
     # 補欄位
     for c in ["name", "district", "temp", "humidity", "time"]:
         if c not in df.columns:
             df[c] = None
 
-    # 分級與建議
-    df["level"] = df["pm25"].apply(lambda x: pm25_level(float(x))[0])
-    df["advice"] = df["pm25"].apply(lambda x: pm25_level(float(x))[1])
-    df["level_tag"] = df["level"].apply(pm25_tag)
-    df["color"] = df["level"].apply(color_of)
+    # 分級與建議（pd.cut 一次分箱，結果本身就是 LEVEL_DTYPE 的 category，直接拿來查表）
+    # category 的 map 只查 4 個分類；advice/level_tag 轉回一般字串欄
+    df["level"] = pd.cut(df["pm25"], bins=PM25_BINS, labels=PM25_LEVELS).astype(LEVEL_DTYPE)
+    df["advice"] = df["level"].map(LEVEL_TO_ADVICE).astype(object)
+    df["level_tag"] = df["level"].map(LEVEL_TO_TAG).astype(object)
+
+    # 顏色存成 4 個 uint8 欄位（pydeck 用 [color_r, color_g, color_b, color_a] 取用），不放 Python list
+    rgba = LEVEL_RGBA[df["level"].cat.codes.to_numpy()]
+    for i, c in enumerate(RGBA_COLS):
+        df[c] = rgba[:, i]
+
+    # 半徑只跟 pm25 有關，跟著快取一起算好
+    df["radius"] = (df["pm25"].clip(0, 200) / 2.5 + 40).clip(40, 180)
+
+    # 低基數欄位改用 category：groupby 以整數代碼聚合、記憶體也小很多
+    # （name 幾乎每個點位都不同，轉 category 反而更大，維持字串）
+    df["district"] = df["district"].fillna("（未提供行政區）").astype("category")
+    df["name"] = df["name"].fillna("（未命名點位）")
+
+    # tooltip 也只跟這一列的值有關：整欄字串運算組合一次，之後每次重跑只挑欄位
+    # 數字用 np.char.mod 格式化，與 f"{x:.1f}" 進位一致（Series.round 遇 18.95 這類值會不同）
+    pm = pd.Series(np.char.mod("%.1f", df["pm25"].to_numpy(dtype=float)), index=df.index)
+    temp = df["temp"].to_numpy(dtype=float)
+    hum = df["humidity"].to_numpy(dtype=float)
+    t_txt = pd.Series(
+        np.where(np.isnan(temp), "未提供", np.char.add(np.char.mod("%.1f", temp), "°C")), index=df.index
+    )
+    h_txt = pd.Series(
+        np.where(np.isnan(hum), "未提供", np.char.add(np.char.mod("%.0f", hum), "%")), index=df.index
+    )
+    # category 欄位要先轉成字串才能相加
+    df["tooltip"] = (
+        df["name"].astype(str)
+        + "\n行政區：" + df["district"].astype(str)
+        + "\nPM2.5：" + pm + "（" + df["level"].astype(str) + "）"
+        + "\n溫度：" + t_txt + "｜濕度：" + h_txt
+        + "\n建議：" + df["advice"]
+    )
 
-    return df
+    # 最後才濾掉缺經緯度/PM2.5 的列：之後不再改欄位，就不需要 .copy() 一份
+    return df.dropna(subset=["lon", "lat", "pm25"])
+
+
+# time 欄位已知格式（依出現頻率排序）；上午/下午 會先換成 AM/PM
+TIME_FORMATS = ["%Y/%m/%d %p %I:%M:%S", "ISO8601", "%Y/%m/%d %H:%M:%S"]
 
 
 def infer_latest_time_from_timecol(df: pd.DataFrame) -> Optional[str]:
@@ -188,35 +293,26 @@ def infer_latest_time_from_timecol(df: pd.DataFrame) -> Optional[str]:
          .str.replace("  ", " ", regex=False)
     )
 
-    # 2) 先用明確格式嘗試（最穩）
-    parsed = pd.to_datetime(s2, format="%Y/%m/%d %p %I:%M:%S", errors="coerce")
+    # 2) 依序用明確格式嘗試（最穩，且整欄走 C 迴圈），每輪只處理前面沒解析成功的
+    parsed = pd.to_datetime(s2, format=TIME_FORMATS[0], errors="coerce")
+    for fmt in TIME_FORMATS[1:]:
+        miss = parsed.isna()
+        if not miss.any():
+            break
+        parsed.loc[miss] = pd.to_datetime(s2[miss], format=fmt, errors="coerce")
 
-    # 3) 若還有沒成功的，再用較寬鬆解析補救
-    if parsed.isna().any():
-        parsed2 = pd.to_datetime(s2[parsed.isna()], errors="coerce")
-        parsed.loc[parsed.isna()] = parsed2
+    # 3) 若還有沒成功的，再用較寬鬆（逐筆推斷格式）解析補救
+    miss = parsed.isna()
+    if miss.any():
+        parsed.loc[miss] = pd.to_datetime(s2[miss], errors="coerce")
 
     parsed = parsed.dropna()
     if parsed.empty:
         return None
 
     return parsed.max().strftime("%Y-%m-%d %H:%M:%S")
-    
-    if "time" not in df.columns:
-        return None
-    s = df["time"].dropna().astype(str).str.strip()
-    if s.empty:
-        return None
-    parsed = pd.to_datetime(s, errors="coerce")
-    parsed = parsed.dropna()
-    if parsed.empty:
-        return None
-    return parsed.max().strftime("%Y-%m-%d %H:%M:%S")
 
 
-from datetime import datetime, timezone
-from zoneinfo import ZoneInfo
-
 def file_mtime_str(path: str) -> Optional[str]:
     """
     Streamlit Cloud 通常以 UTC 顯示時間，這裡強制轉成臺灣時間（Asia/Taipei）
@@ -230,6 +326,75 @@ def file_mtime_str(path: str) -> Optional[str]:
         return None
 
 
+# -----------------------------
+# Parquet 快照（JSON 正規化後的結果，下次直接讀）
+# -----------------------------
+# normalize_df 輸出的欄位或型別有改就 +1：版本不同的舊 Parquet 會被忽略、改從 JSON 重建
+PARQUET_SCHEMA_VERSION = "4"
+
+
+def parquet_path_of(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + ".parquet"
+
+
+def snapshot_source_meta(json_mtime: float, json_size: int) -> Dict[bytes, bytes]:
+    # 記下 Parquet 是從哪一版 JSON（mtime + 大小）轉出來的；只比「誰比較新」擋不住 cp -p / rsync 換回舊檔
+    return {b"source_mtime": repr(json_mtime).encode("utf-8"), b"source_size": str(json_size).encode("utf-8")}
+
+
+def read_parquet_snapshot(
+    parquet_path: str, json_mtime: float, json_size: int
+) -> Optional[Tuple[pd.DataFrame, Optional[str]]]:
+    """
+    Parquet 存在且來源 JSON 的 mtime/大小與記錄完全相同才使用；回傳 (df, snapshot_fetched_at)，否則 None。
+    """
+    if pq is None or not os.path.exists(parquet_path):
+        return None
+    try:
+        tbl = pq.read_table(parquet_path)
+    except Exception:
+        return None  # 檔案損毀或寫到一半：退回 JSON
+
+    file_meta = tbl.schema.metadata or {}
+    if file_meta.get(b"schema_version") != PARQUET_SCHEMA_VERSION.encode("utf-8"):
+        return None
+    if any(file_meta.get(k) != v for k, v in snapshot_source_meta(json_mtime, json_size).items()):
+        return None
+
+    df = tbl.to_pandas()
+    fetched_at = file_meta.get(b"snapshot_fetched_at")
+    return df, fetched_at.decode("utf-8") if fetched_at else None
+
+
+def write_parquet_snapshot(
+    df: pd.DataFrame, parquet_path: str, fetched_at: Optional[str], json_mtime: float, json_size: int
+) -> None:
+    if pq is None or df.empty:
+        return
+
+    # 先寫到各執行緒自己的暫存檔再 os.replace：多個 session 同時寫也不會讀到寫一半的檔案
+    root, ext = os.path.splitext(parquet_path)
+    tmp_path = f"{root}.tmp-{os.getpid()}-{threading.get_ident()}{ext}"
+    try:
+        tbl = pa.Table.from_pandas(df)
+        file_meta = {
+            **(tbl.schema.metadata or {}),
+            b"schema_version": PARQUET_SCHEMA_VERSION.encode("utf-8"),
+            **snapshot_source_meta(json_mtime, json_size),
+        }
+        if fetched_at:
+            file_meta[b"snapshot_fetched_at"] = fetched_at.encode("utf-8")
+        tbl = tbl.replace_schema_metadata(file_meta)
+        pq.write_table(tbl, tmp_path, compression="zstd")
+        os.replace(tmp_path, parquet_path)
+    except Exception:
+        # 唯讀環境或欄位型別無法寫入：不影響顯示，下次照樣從 JSON 讀
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
 # -----------------------------
 # Sidebar
 # -----------------------------
@@ -272,8 +437,8 @@ st.sidebar.markdown("---")
 st.sidebar.markdown("## 顯示選項（共用）")
 only_geo = st.sidebar.checkbox("只顯示有經緯度的點位", value=True)
 only_hot = st.sidebar.checkbox("只顯示超標點位（PM2.5 > 35.4）", value=False)
-show_radius = st.sidebar.checkbox("點位半徑隨 PM2.5 變化（自動縮放感）", value=True)
-topn = st.sidebar.slider("Top N（PM2.5）", 10, 100, 50, 5)
+
+st.sidebar.caption("地圖點位大小／六角網格、Top N 筆數在各區塊旁調整，只會重畫該區塊。")
 
 st.sidebar.markdown("---")
 st.sidebar.caption("🔒 雲端固定只讀 JSON 快照，不連線政府 API（避免 SSL 憑證問題，穩定展示）。")
@@ -283,28 +448,48 @@ if btn_clear:
     st.toast("已清除快取", icon="🧹")
 
 if btn_refresh:
-    st.cache_data.clear()
-    st.toast("已重新讀取（清除快取後載入）", icon="🔄")
+    # 快照以檔案 mtime 為快取鍵；按鈕只遞增 _cache_bust 強制重讀快照，不動其他快取
+    st.session_state["_cache_bust"] = st.session_state.get("_cache_bust", 0) + 1
+    st.toast("已重新讀取快照", icon="🔄")
 
 
 # -----------------------------
-# 讀資料（核心：只讀 JSON）
+# 讀資料（核心：只讀快照；有新鮮的 Parquet 就不重新解析 JSON）
 # -----------------------------
-@st.cache_data(ttl=60)
-def load_data_snapshot() -> Tuple[pd.DataFrame, Dict[str, Any]]:
-    meta: Dict[str, Any] = {
+def _base_meta(path: str) -> Dict[str, Any]:
+    # 快照 meta 的共同欄位；檔案不存在時就是這份，快照相關欄位維持 None
+    return {
         "source": "臺中市政府 OpenData（微型感測）",
-        "snapshot_path": DATA_JSON_PATH,
+        "snapshot_path": path,
         "used": "snapshot_json_only",
         "loaded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "snapshot_mtime": file_mtime_str(DATA_JSON_PATH),
+        "snapshot_mtime": None,
+        "snapshot_mtime_ts": None,
+        "snapshot_size": None,
         "snapshot_fetched_at": None,  # 若 fetch_local.py 有寫入 fetched_at，我們會抓
     }
 
-    if not os.path.exists(DATA_JSON_PATH):
-        return pd.DataFrame(), meta
 
-    obj = load_json_snapshot(DATA_JSON_PATH)
+# 鍵含 mtime / _cache_bust：舊快照不會再被用到，只留最近幾份，避免 DataFrame 一直堆在記憶體
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_snapshot_by_mtime(
+    path: str, mtime: float, size: int, cache_bust: int = 0
+) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    以 (path, mtime, size) 為快取鍵：JSON 沒變就沿用同一份 DataFrame，不再每 60 秒重新解析。
+    cache_bust 只用來讓「立即更新」按鈕強制重讀。
+    快取失效時優先讀同名 .parquet（已正規化、已分級），沒有或過期才解析 JSON 並寫回 Parquet。
+    """
+    meta = _base_meta(path)
+    meta.update(snapshot_mtime=file_mtime_str(path), snapshot_mtime_ts=mtime, snapshot_size=size)
+
+    parquet_path = parquet_path_of(path)
+    cached = read_parquet_snapshot(parquet_path, mtime, size)
+    if cached is not None:
+        df, meta["snapshot_fetched_at"] = cached
+        return df, meta
+
+    obj = load_json_snapshot(path)
 
     # 若 fetch_local.py 有寫 meta 欄位（例如 fetched_at），這裡可讀出來
     if isinstance(obj, dict):
@@ -316,9 +501,78 @@ def load_data_snapshot() -> Tuple[pd.DataFrame, Dict[str, Any]]:
 
     records = extract_records(obj)
     df = normalize_df(records)
+    write_parquet_snapshot(df, parquet_path, meta["snapshot_fetched_at"], mtime, size)
     return df, meta
 
 
+def load_data_snapshot() -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    # 每次 rerun 都會走到這裡：只 stat 一次（取 mtime/大小，順便判斷檔案在不在）
+    try:
+        stat = os.stat(DATA_JSON_PATH)
+    except OSError:
+        return pd.DataFrame(), _base_meta(DATA_JSON_PATH)
+
+    return _load_snapshot_by_mtime(
+        DATA_JSON_PATH, stat.st_mtime, stat.st_size, st.session_state.get("_cache_bust", 0)
+    )
+
+
+def compute_district_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    行政區彙整（依最高 PM2.5 排序，同分依行政區名稱）。
+    只由 precompute_views 呼叫，結果跟著它的快取存一份，這裡不再另外快取。
+    """
+    return (
+        df[["district", "pm25"]]
+        .groupby("district", dropna=False, observed=True)
+        .agg(max_pm25=("pm25", "max"), avg_pm25=("pm25", "mean"), cnt=("pm25", "count"))
+        .reset_index()
+        .sort_values(["max_pm25", "district"], ascending=[False, True])
+        .reset_index(drop=True)
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def precompute_views(_df: pd.DataFrame, snapshot_key: Tuple[Any, ...]) -> Dict[str, Any]:
+    """
+    只跟快照與篩選條件有關的衍生結果（行政區選單、彙整表、Top3 文字），
+    同一 snapshot_key 只算一次；切換行政區、拖 Top N 等互動都直接取用。
+    """
+    districts = ["全市"] + sorted([d for d in _df["district"].unique().tolist() if str(d).strip() != ""])
+    grp = compute_district_summary(_df)
+
+    # Top3 文字整欄組合（分級沿用 pd.cut 查表），組好的 markdown 直接快取
+    top3 = grp.head(3)
+    lvl = pd.cut(top3["max_pm25"], bins=PM25_BINS, labels=PM25_LEVELS).astype(str)
+    top3_md = (
+        "- **" + top3["district"].astype(str) + "**："
+        + "最高 " + np.char.mod("%.1f", top3["max_pm25"].to_numpy(dtype=float))
+        + "（平均 " + np.char.mod("%.1f", top3["avg_pm25"].to_numpy(dtype=float))
+        + "，點位 " + top3["cnt"].astype(int).astype(str) + "）"
+        + "　" + lvl.map(LEVEL_TO_TAG) + " " + lvl + "｜" + lvl.map(LEVEL_TO_ADVICE)
+    ).str.cat(sep="\n")
+
+    return {"districts": districts, "grp": grp, "top3_md": top3_md}
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def compute_view_stats(_df_view: pd.DataFrame, view_key: Tuple[Any, ...]) -> Dict[str, Any]:
+    """
+    目前檢視範圍（全市或單一行政區）的 KPI 與專業統計，含 time 欄位解析。
+    view_key = snapshot_key + 行政區；只動地圖/表格選項時直接取快取。
+    """
+    pm = _df_view["pm25"]
+    return {
+        "count": len(_df_view),
+        "median": float(pm.median()) if not _df_view.empty else 0.0,
+        "max": float(pm.max()),
+        "mean": float(pm.mean()),
+        "q75": float(pm.quantile(0.75)),
+        "hot": int((pm > 35.4).sum()),
+        "latest_time": infer_latest_time_from_timecol(_df_view),
+    }
+
+
 df, meta = load_data_snapshot()
 
 # -----------------------------
@@ -352,24 +606,30 @@ if only_geo:
 if only_hot:
     df = df[df["pm25"] > 35.4]
 
-df["district"] = df["district"].fillna("（未提供行政區）")
-df["name"] = df["name"].fillna("（未命名點位）")
+# 彙整類快取的鍵：同一份快照 + 同樣的篩選條件 → 結果相同
+snapshot_key = (
+    meta.get("snapshot_mtime_ts"),
+    meta.get("snapshot_size"),
+    st.session_state.get("_cache_bust", 0),
+    only_geo,
+    only_hot,
+)
 
-districts = ["全市"] + sorted([d for d in df["district"].unique().tolist() if str(d).strip() != ""])
+views = precompute_views(df, snapshot_key)
 st.markdown("### 選擇行政區（聚焦查看）")
-sel_dist = st.selectbox("行政區", districts, index=0, label_visibility="collapsed")
+sel_dist = st.selectbox("行政區", views["districts"], index=0, label_visibility="collapsed")
 
-df_view = df.copy()
-if sel_dist != "全市":
-    df_view = df[df["district"] == sel_dist].copy()
+# df_view 只讀不改，直接用布林索引的結果，不另外 .copy()
+df_view = df if sel_dist == "全市" else df.loc[df["district"] == sel_dist]
 
 # -----------------------------
 # KPI 與時間（不再顯示未知）
 # -----------------------------
-pm25_median = float(df_view["pm25"].median()) if not df_view.empty else 0.0
+stats = compute_view_stats(df_view, (*snapshot_key, sel_dist))
+pm25_median = stats["median"]
 level_txt, advice_txt = pm25_level(pm25_median)
 
-latest_from_timecol = infer_latest_time_from_timecol(df_view)
+latest_from_timecol = stats["latest_time"]
 
 # 顯示優先順序：
 # 1) time欄位推得的最新時間
@@ -386,9 +646,9 @@ else:
     latest_time_display = str(meta["loaded_at"]) + "（載入時間）"
 
 k1, k2, k3, k4 = st.columns(4)
-k1.metric("點位數（每裝置取最新一筆）", f"{len(df_view):,}")
+k1.metric("點位數（每裝置取最新一筆）", f"{stats['count']:,}")
 k2.metric("PM2.5 中位數", f"{pm25_median:.1f}", f"{pm25_tag(level_txt)} {level_txt}")
-k3.metric("PM2.5 最大值", f"{float(df_view['pm25'].max()):.1f}")
+k3.metric("PM2.5 最大值", f"{stats['max']:.1f}")
 k4.metric("資料時間（最新）", latest_time_display)
 
 # -----------------------------
@@ -398,22 +658,7 @@ st.markdown("## 快速判讀")
 st.info(f"目前 {sel_dist} 整體空品以「{level_txt}」為主（PM2.5 中位數 {pm25_median:.1f}）。{advice_txt}", icon="🧭")
 
 st.markdown("## 你需要留意什麼？")
-grp = (
-    df.groupby("district", dropna=False)
-    .agg(max_pm25=("pm25", "max"), avg_pm25=("pm25", "mean"), cnt=("pm25", "count"))
-    .reset_index()
-    .sort_values("max_pm25", ascending=False)
-)
-top3 = grp.head(3)
-
-lines = []
-for _, r in top3.iterrows():
-    lvl, adv = pm25_level(float(r["max_pm25"]))
-    lines.append(
-        f"- **{r['district']}**：最高 {r['max_pm25']:.1f}（平均 {r['avg_pm25']:.1f}，點位 {int(r['cnt'])}）"
-        f"　{pm25_tag(lvl)} {lvl}｜{adv}"
-    )
-st.markdown("\n".join(lines))
+st.markdown(views["top3_md"])
 
 st.markdown("## 看圖小抄")
 st.markdown(
@@ -428,43 +673,6 @@ st.markdown(
 # -----------------------------
 st.markdown("## 地圖（點位分佈：依 PM2.5 分級上色）")
 
-def build_tooltip(row: pd.Series) -> str:
-    pm = float(row.get("pm25", 0.0))
-    lvl = row.get("level", "")
-    adv = row.get("advice", "")
-    t = row.get("temp")
-    h = row.get("humidity")
-    t_txt = f"{float(t):.1f}°C" if pd.notna(t) else "未提供"
-    h_txt = f"{float(h):.0f}%" if pd.notna(h) else "未提供"
-    return (
-        f"{row.get('name','（未命名點位）')}\n"
-        f"行政區：{row.get('district','（未提供行政區）')}\n"
-        f"PM2.5：{pm:.1f}（{lvl}）\n"
-        f"溫度：{t_txt}｜濕度：{h_txt}\n"
-        f"建議：{adv}"
-    )
-
-df_map = df_view.copy()
-df_map["tooltip"] = df_map.apply(build_tooltip, axis=1)
-
-if show_radius:
-    df_map["radius"] = (df_map["pm25"].clip(0, 200) / 2.5 + 40).clip(40, 180)
-else:
-    df_map["radius"] = 60
-
-center_lat = float(df_map["lat"].mean())
-center_lon = float(df_map["lon"].mean())
-
-layer = pdk.Layer(
-    "ScatterplotLayer",
-    data=df_map,
-    get_position="[lon, lat]",
-    get_fill_color="color",
-    get_radius="radius",
-    pickable=True,
-    auto_highlight=True,
-)
-
 # zoom 不寫死太死：依點位範圍略微調整
 # 簡化策略：全市預設 11，特定行政區略放大
 zoom = 11 if sel_dist == "全市" else 12
@@ -474,34 +682,111 @@ if map_theme.startswith("黑色"):
 else:
     map_style = "https://basemaps.cartocdn.com/gl/positron-gl-style/style.json"
 
-deck = pdk.Deck(
-    layers=[layer],
-    map_style=map_style,
-    initial_view_state=pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=zoom, pitch=0),
-    tooltip={"text": "{tooltip}"},
-)
+# 數字位數也會變成 JSON 字元：經緯度 5 位（約 1 公尺）、半徑 1 位就夠，避免 51.980000000000004 這種長尾
+MAP_ROUND = {"lon": 5, "lat": 5, "radius": 1, "pm25": 2}
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def build_deck(
+    _df_map: pd.DataFrame, view_key: Tuple, show_radius: bool, use_hex: bool, zoom: int, map_style: str
+) -> pdk.Deck:
+    """
+    組出 pydeck Deck；同一份快照/篩選/選項只建一次。
+    pdk.Layer 建立時就會把 DataFrame 轉成整包 records，切 checkbox 來回時直接重用。
+    （view_key 已涵蓋 _df_map 的內容；回傳的 Deck 只讀不改）
+    """
+    center_lat = float(_df_map["lat"].mean())
+    center_lon = float(_df_map["lon"].mean())
+
+    if use_hex:
+        layer = pdk.Layer(
+            "HexagonLayer",
+            data=_df_map[["lon", "lat", "pm25"]].round(MAP_ROUND),
+            get_position="[lon, lat]",
+            get_color_weight="pm25",
+            color_aggregation=pdk.types.String("MEAN"),
+            radius=300,
+            elevation_scale=4,
+            extruded=True,
+            coverage=1,
+            pickable=True,
+            auto_highlight=True,
+        )
+        map_tooltip = {"text": "點位數：{elevationValue}\nPM2.5 平均：{colorValue}"}
+    else:
+        # pydeck 會把 data 整包轉成 JSON 送到瀏覽器：只送畫圖需要的欄位
+        # 固定半徑時直接給常數，不必每個點都帶一個 radius
+        map_cols = ["lon", "lat", *RGBA_COLS, "tooltip"] + (["radius"] if show_radius else [])
+        layer = pdk.Layer(
+            "ScatterplotLayer",
+            data=_df_map[map_cols].round(MAP_ROUND),
+            get_position="[lon, lat]",
+            get_fill_color="[color_r, color_g, color_b, color_a]",
+            get_radius="radius" if show_radius else RADIUS_FIXED,
+            pickable=True,
+            auto_highlight=True,
+        )
+        map_tooltip = {"text": "{tooltip}"}
+
+    return pdk.Deck(
+        layers=[layer],
+        map_style=map_style,
+        initial_view_state=pdk.ViewState(
+            latitude=center_lat, longitude=center_lon, zoom=zoom, pitch=40 if use_hex else 0
+        ),
+        tooltip=map_tooltip,
+    )
+
+
+@st.fragment
+def render_map(df_map: pd.DataFrame, view_key: Tuple, zoom: int, map_style: str) -> None:
+    """
+    地圖區塊（fragment）：切換半徑/六角網格只重跑這裡，不重跑整頁。
+    """
+    o1, o2 = st.columns(2)
+    show_radius = o1.checkbox("點位半徑隨 PM2.5 變化（自動縮放感）", value=True)
+    use_hex = o2.checkbox(
+        "改用六角網格彙整（點位很多時較順）",
+        value=False,
+        help="以 HexagonLayer 在瀏覽器端聚合：柱高＝點位數、顏色＝平均 PM2.5。",
+    )
+
+    deck = build_deck(df_map, view_key, show_radius, use_hex, zoom, map_style)
+    st.pydeck_chart(deck, use_container_width=True)
 
-st.pydeck_chart(deck, use_container_width=True)
+
+render_map(df_view, (*snapshot_key, sel_dist), zoom, map_style)
 
 # -----------------------------
 # 表格：Top N +（專業模式）行政區彙整表
 # -----------------------------
-st.markdown(f"## PM2.5 前 {topn} 高點位")
-df_top = df_view.sort_values("pm25", ascending=False).head(topn).copy()
+@st.fragment
+def render_top_table(df_view: pd.DataFrame) -> None:
+    """
+    Top N 表格（fragment）：拖動 Top N 只重跑這個表格。
+    """
+    title = st.empty()  # 標題要顯示 N，但 slider 在標題下方：先佔位
+    topn = st.slider("Top N（PM2.5）", 10, 100, 50, 5)
+    title.markdown(f"## PM2.5 前 {topn} 高點位")
+
+    df_top = df_view.sort_values("pm25", ascending=False).head(topn)
+
+    show_cols = ["level_tag", "name", "district", "pm25", "temp", "humidity", "level", "advice", "time", "lon", "lat"]
+    show_cols = [c for c in show_cols if c in df_top.columns]
+    st.dataframe(df_top[show_cols], use_container_width=True, height=380)
+
 
-show_cols = ["level_tag", "name", "district", "pm25", "temp", "humidity", "level", "advice", "time", "lon", "lat"]
-show_cols = [c for c in show_cols if c in df_top.columns]
-st.dataframe(df_top[show_cols], use_container_width=True, height=380)
+render_top_table(df_view)
 
 if mode.startswith("專業"):
     st.markdown("## 專業摘要（統計）")
     c1, c2, c3 = st.columns(3)
-    c1.metric("PM2.5 平均", f"{float(df_view['pm25'].mean()):.1f}")
-    c2.metric("PM2.5 75 分位數", f"{float(df_view['pm25'].quantile(0.75)):.1f}")
-    c3.metric("超標點位數（>35.4）", f"{int((df_view['pm25'] > 35.4).sum()):,}")
+    c1.metric("PM2.5 平均", f"{stats['mean']:.1f}")
+    c2.metric("PM2.5 75 分位數", f"{stats['q75']:.1f}")
+    c3.metric("超標點位數（>35.4）", f"{stats['hot']:,}")
 
     st.markdown("### 行政區分佈（依最高 PM2.5 排序）")
-    st.dataframe(grp.head(30), use_container_width=True)
+    st.dataframe(views["grp"].head(30), use_container_width=True)
 
 # -----------------------------
 # Footer
@@ -1,10 +1,22 @@
 import os
+import re
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from types import MappingProxyType
+from typing import Optional
 from urllib.parse import urlencode, urlparse, parse_qs, urlunparse
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson 解析/輸出都比標準庫 json 快；沒安裝就退回 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -15,9 +27,55 @@ load_dotenv(os.path.join(APP_DIR, ".env"))
 
 UUID = "33093aab-c094-4caf-9653-389ee511a618"
 
+# 去掉前後空白與外層引號（.env 常寫成 KEY="..." 或 KEY='...'）
+_ENV_STRIP = re.compile(r"""^\s*['"]?(.*?)['"]?\s*$""", re.DOTALL)
+
+
+def env_str(name: str) -> str:
+    return _ENV_STRIP.match(os.getenv(name, "")).group(1)
+
+
 # 你可以在 .env 設定 TAICHUNG_MICRO_API_URL；沒設就用候選清單自動嘗試
-ENV_URL = os.getenv("TAICHUNG_MICRO_API_URL", "").strip().strip('"').strip("'")
-API_KEY = os.getenv("TAICHUNG_MICRO_API_KEY", "").strip().strip('"').strip("'")
+ENV_URL = env_str("TAICHUNG_MICRO_API_URL")
+API_KEY = env_str("TAICHUNG_MICRO_API_KEY")
+PRETTY_JSON = env_str("TAICHUNG_CACHE_PRETTY") == "1"
+
+# 自動候選清單（避免你一直手動換）：只跟 UUID 有關，載入時組一次
+_BASE = "https://datacenter.taichung.gov.tw"
+AUTO_CANDIDATES = (
+    f"{_BASE}/OpenData/{UUID}",
+    f"{_BASE}/swagger/OpenData/{UUID}",
+    f"{_BASE}/api/OpenData/{UUID}",
+    f"{_BASE}/openapi/OpenData/{UUID}",
+)
+
+HEADERS = MappingProxyType({
+    "User-Agent": "Mozilla/5.0",
+    "Accept": "application/json,text/plain,*/*",
+})
+# API_KEY 只在載入時讀一次，帶認證的 headers 也只組一次；唯讀，每個請求直接共用不必複製
+REQUEST_HEADERS = (
+    MappingProxyType({**HEADERS, "Authorization": API_KEY, "X-API-KEY": API_KEY}) if API_KEY else HEADERS
+)
+
+# 共用一個 Session（keep-alive）：候選 URL 都在同一台主機，換 URL 不必重新 TCP + TLS 握手
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        # 只重試 429/5xx 回應；連線/讀取逾時不重試，否則每個 timeout 會變成三倍
+        max_retries=Retry(
+            total=None,
+            connect=0,
+            read=0,
+            status=2,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ),
+)
 
 
 def ensure_dir(p: str):
@@ -33,6 +91,19 @@ def with_query(url: str, add_params: dict) -> str:
     return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
 
 
+# 每個請求都帶同一組分頁參數：直接接字串，不必每次 parse/urlencode 整個 URL
+PAGE_PARAMS = {"limit": 1000, "offset": 0}
+PAGE_QUERY = urlencode(PAGE_PARAMS)
+_HAS_PAGE_PARAM = re.compile(r"[?&](?:limit|offset)=")
+
+
+def with_page_query(url: str) -> str:
+    # 使用者自訂的 URL 已經帶 limit/offset（或有 #fragment）才走完整解析，改寫成固定值
+    if "#" in url or _HAS_PAGE_PARAM.search(url):
+        return with_query(url, PAGE_PARAMS)
+    return url + ("&" if "?" in url else "?") + PAGE_QUERY
+
+
 def normalize_records(payload):
     if isinstance(payload, list):
         return payload
@@ -49,18 +120,7 @@ def normalize_records(payload):
 
 def build_candidates() -> list[str]:
     # 若使用者在 .env 指定 URL，就把它放第一順位
-    candidates = []
-    if ENV_URL:
-        candidates.append(ENV_URL)
-
-    # 自動候選清單（避免你一直手動換）
-    base = "https://datacenter.taichung.gov.tw"
-    candidates += [
-        f"{base}/OpenData/{UUID}",
-        f"{base}/swagger/OpenData/{UUID}",
-        f"{base}/api/OpenData/{UUID}",
-        f"{base}/openapi/OpenData/{UUID}",
-    ]
+    candidates = [ENV_URL, *AUTO_CANDIDATES] if ENV_URL else list(AUTO_CANDIDATES)
 
     # 去重（維持順序）
     seen = set()
@@ -72,24 +132,36 @@ def build_candidates() -> list[str]:
     return uniq
 
 
-def fetch_json(url: str):
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Accept": "application/json,text/plain,*/*",
-    }
-    if API_KEY:
-        headers["Authorization"] = API_KEY
-        headers["X-API-KEY"] = API_KEY
+def probe(url: str) -> Optional[int]:
+    """
+    用 HEAD 探測候選 URL（只拿狀態碼，不下載資料本體）。
+    回傳 HTTP 狀態碼；逾時或連不上時回傳 None。
+    """
+    try:
+        r = SESSION.head(
+            with_page_query(url),
+            headers=REQUEST_HEADERS,
+            timeout=5,
+            allow_redirects=True,
+        )
+    except requests.RequestException:
+        return None
+    return r.status_code
 
-    final_url = with_query(url, {"limit": 1000, "offset": 0})
 
-    r = requests.get(final_url, headers=headers, timeout=35)
+def fetch_json(url: str):
+    final_url = with_page_query(url)
+
+    r = SESSION.get(final_url, headers=REQUEST_HEADERS, timeout=35)
     r.raise_for_status()
 
+    # 直接解析 bytes，不必先解碼成 str（r.text 會再猜一次編碼、多複製一份）
     try:
-        return final_url, r.json()
-    except Exception:
-        return final_url, json.loads(r.text)
+        payload = orjson.loads(r.content) if orjson is not None else json.loads(r.content)
+    except ValueError:
+        print(f"⚠️ 回應不是 JSON：{final_url}\n{r.content[:200]!r}")
+        raise
+    return final_url, payload
 
 
 def main():
@@ -99,7 +171,20 @@ def main():
     used_url = None
     payload = None
 
-    for u in candidates:
+    # 先對所有候選同時送 HEAD 探測，再依原本的優先順序只對活著的 URL 發 GET：
+    # 死掉的 URL 不必等它逾時，也不會為了排在後面的候選白白下載整包資料
+    with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+        statuses = list(pool.map(probe, candidates))
+    # HEAD 成功（或伺服器不支援 HEAD：405/501）的優先；
+    # HEAD 回了 HTTP 錯誤碼（403/404…）的排到最後當備援（有些伺服器 HEAD 與 GET 行為不一致）；
+    # HEAD 逾時/連不上的主機 GET 多半也會卡住，直接略過，不再各等 35 秒
+    alive, fallback = [], []
+    for u, code in zip(candidates, statuses):
+        if code is None:
+            continue
+        (alive if code < 400 or code in (405, 501) else fallback).append(u)
+
+    for u in alive + fallback:
         try:
             used_url, payload = fetch_json(u)
             break
@@ -107,6 +192,8 @@ def main():
             last_err = e
 
     if payload is None:
+        if last_err is None:
+            raise RuntimeError("所有候選 API 都連不上（HEAD 逾時或連線失敗）")
         raise RuntimeError(f"所有候選 API 都失敗，最後錯誤：{last_err}")
 
     records = normalize_records(payload)
@@ -121,8 +208,17 @@ def main():
         "records": records,
     }
 
-    with open(OUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False, indent=2)
+    # 預設輸出精簡 JSON（去掉縮排空白，目前快照約小 30%）；要用眼睛看時設 TAICHUNG_CACHE_PRETTY=1 改成縮排格式
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if PRETTY_JSON else 0)
+        with open(OUT_FILE, "wb") as f:
+            f.write(orjson.dumps(out, option=option))
+    else:
+        with open(OUT_FILE, "w", encoding="utf-8") as f:
+            if PRETTY_JSON:
+                json.dump(out, f, ensure_ascii=False, indent=2)
+            else:
+                json.dump(out, f, ensure_ascii=False, separators=(",", ":"))
 
     print(f"✅ 已更新：{OUT_FILE}")
     print(f"✅ 使用 API：{used_url}")